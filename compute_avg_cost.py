@@ -3,60 +3,96 @@
 
 import json
 import re
+import sys
 import argparse
-from datetime import datetime
-from collections import defaultdict
+from datetime import date, datetime
 from pathlib import Path
+from typing import NamedTuple
+
+try:  # optional, considerably faster on large exports
+    import orjson
+except ImportError:
+    orjson = None
+
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+_TIMES_RE = re.compile(r'(-?\d+[\.,]?\d*)\s*×\s*(-?\d+[\.,]?\d*)')
+_CANCEL_RE = re.compile(r'storniert|abgebrochen|abgelaufen')
+
+_SHARE_TITLES = frozenset(('Aktien', 'Stück', 'Anteile'))
+_PRICE_TITLES = frozenset(('Aktienkurs', 'Preis', 'Ausführungskurs'))
+
+_MONEY_TBL = str.maketrans({'\xa0': None, ' ': None, '€': None, '$': None, '.': None, ',': '.'})
+_SHARES_TBL = str.maketrans({'\xa0': None, ' ': None, '.': None, ',': '.'})
+
+
+class Sale(NamedTuple):
+    """One realized sale in the reported year."""
+    date: date
+    title: str
+    isin: str
+    shares: float
+    proceeds: float
+    cost_basis: float
+    profit: float
+
+
+_EMPTY = {}  # shared read-only default for missing sub-dicts
+
+
+def _disp_or_text(detail):
+    """Cell text of a TR table row: displayValue.text, falling back to text."""
+    try:
+        return detail['displayValue']['text'] or detail.get('text')
+    except (KeyError, TypeError):
+        return detail.get('text')
+
 
 # Helper to clean and convert German/European formatted money strings
 
 def parse_money(text):
     if text is None:
         return None
-    # normalize spaces and currency symbols
-    clean = str(text).replace('\xa0', '').replace('€', '').replace('$', '').replace(' ', '')
-    # remove thousand separators (.) and use dot as decimal
-    clean = clean.replace('.', '').replace(',', '.')
+    # drop spaces, currency symbols and thousand separators (.), use dot as decimal
+    clean = str(text).translate(_MONEY_TBL)
     try:
         return float(clean)
     except ValueError:
         # fall back to regex extraction
-        m = re.search(r'-?\d+(?:\.\d+)?', clean)
+        m = _NUMBER_RE.search(clean)
         return float(m.group(0)) if m else None
 
 
 def parse_shares(text):
     if text is None:
         return None
-    clean = str(text).replace('\xa0', '').replace(' ', '')
-    clean = clean.replace(',', '.').replace('.', '.')
+    # German format: drop thousand separators (.), use dot as decimal
+    clean = str(text).translate(_SHARES_TBL)
     try:
         return float(clean)
     except ValueError:
-        m = re.search(r'-?\d+(?:\.\d+)?', clean)
+        m = _NUMBER_RE.search(clean)
         return float(m.group(0)) if m else None
 
 
 def find_instrument_type(obj):
-    if isinstance(obj, dict):
-        if 'instrumentType' in obj:
-            return obj['instrumentType']
-        for v in obj.values():
-            found = find_instrument_type(v)
-            if found:
-                return found
-    elif isinstance(obj, list):
-        for v in obj:
-            found = find_instrument_type(v)
+    # iterative depth-first scan; children are pushed reversed to keep document order
+    stack = [obj]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, dict):
+            found = x.get('instrumentType')
             if found:
                 return found
+            stack.extend(reversed(x.values()))
+        elif isinstance(x, list):
+            stack.extend(reversed(x))
     return None
 
 
 def parse_trade_event(ev):
     subtitle = (ev.get('subtitle') or '').lower()
     # quick status guard: skip cancelled/expired orders
-    if any(word in subtitle for word in ('storniert', 'abgebrochen', 'abgelaufen')):
+    if _CANCEL_RE.search(subtitle):
         return None
 
     # prefer explicit status flag if present
@@ -71,53 +107,60 @@ def parse_trade_event(ev):
     else:
         return None
 
-    ts_raw = ev.get('timestamp')
-    ts = datetime.fromisoformat(ts_raw.replace('+0000', '+00:00')) if ts_raw else None
-    amount_net = ev.get('amount', {}).get('value')
+    # keep the raw ISO string (TR exports are all UTC, so it sorts chronologically);
+    # a date object is only built for sales that end up in the report
+    ts = ev.get('timestamp')
+    if not ts:
+        return None
+    year = int(ts[:4])
+    amount_net = ev.get('amount', _EMPTY).get('value')
 
     isin = None
     instrument_type = None
     shares = price_per_share = fee = total = None
+    summary_total = False  # 'Summe' row of the Übersicht table seen
 
-    sections = ev.get('details', {}).get('sections', [])
+    sections = ev.get('details', _EMPTY).get('sections', [])
 
     for sec in sections:
         # ISIN is often the payload of the header action
-        act = sec.get('action') or {}
+        act = sec.get('action') or _EMPTY
         payload = act.get('payload') if isinstance(act, dict) else None
         if isinstance(payload, str) and len(payload) == 12:
-            isin = payload
+            isin = sys.intern(payload)  # used as dict key in the reducers
 
         data = sec.get('data')
         if not isinstance(data, list):
             continue
+
+        # instrument type is nested in customerSupportChat context; one scan per section
+        if instrument_type is None:
+            instrument_type = find_instrument_type(data)
+
         for entry in data:
             title = entry.get('title') or ''
-            detail = entry.get('detail', {}) if isinstance(entry, dict) else {}
-
-            # instrument type is nested in customerSupportChat context
-            instrument_type = instrument_type or find_instrument_type(detail)
-            instrument_type = instrument_type or find_instrument_type(entry)
+            detail = entry.get('detail', _EMPTY) if isinstance(entry, dict) else _EMPTY
 
             # parse fee and sum from Übersicht table
             if title == 'Gebühr':
-                fee = parse_money(detail.get('displayValue', {}).get('text') or detail.get('text'))
-            if title == 'Summe':
-                total = parse_money(detail.get('displayValue', {}).get('text') or detail.get('text'))
+                fee = parse_money(_disp_or_text(detail))
+            elif title == 'Summe':
+                total = parse_money(_disp_or_text(detail))
+                summary_total = True
 
             # transaction block can be nested in action payload
-            inner_payload = detail.get('action', {}).get('payload') if isinstance(detail.get('action'), dict) else None
+            inner_payload = detail.get('action', _EMPTY).get('payload') if isinstance(detail.get('action'), dict) else None
             if isinstance(inner_payload, dict):
                 for s2 in inner_payload.get('sections', []):
                     if s2.get('type') != 'table':
                         continue
                     for row in s2.get('data', []):
                         rtitle = row.get('title') or ''
-                        rdetail = row.get('detail', {}) if isinstance(row, dict) else {}
-                        val = rdetail.get('displayValue', {}).get('text') or rdetail.get('text')
-                        if rtitle in ('Aktien', 'Stück', 'Anteile'):
+                        rdetail = row.get('detail', _EMPTY) if isinstance(row, dict) else _EMPTY
+                        val = _disp_or_text(rdetail)
+                        if rtitle in _SHARE_TITLES:
                             shares = parse_shares(val)
-                        elif rtitle in ('Aktienkurs', 'Preis', 'Ausführungskurs'):
+                        elif rtitle in _PRICE_TITLES:
                             price_per_share = parse_money(val)
                         elif rtitle == 'Summe' and total is None:
                             total = parse_money(val)
@@ -125,11 +168,15 @@ def parse_trade_event(ev):
             # quick parse from text like "1 × 156,60 €"
             txt = detail.get('text') if isinstance(detail, dict) else None
             if txt and '×' in txt:
-                m = re.search(r'(-?\d+[\.,]?\d*)\s*×\s*(-?\d+[\.,]?\d*)', txt)
+                m = _TIMES_RE.search(txt)
                 if m:
                     shares = shares or parse_shares(m.group(1))
                     price_per_share = price_per_share or parse_money(m.group(2))
 
+        # remaining sections (documents, support) add nothing once all fields are known
+        if isin and instrument_type and shares and price_per_share and fee is not None and summary_total:
+            break
+
     instrument_type = instrument_type or 'stock'  # default guess
 
     # If total not found, fall back to amount_net
@@ -143,6 +190,7 @@ def parse_trade_event(ev):
 
     return {
         'timestamp': ts,
+        'year': year,
         'side': side,
         'isin': isin,
         'instrument_type': instrument_type,
@@ -154,11 +202,7 @@ def parse_trade_event(ev):
     }
 
 
-def load_trades(events_path: Path):
-    if not events_path.exists():
-        raise SystemExit(f"{events_path} not found. Run 'pytr dl_docs <outdir>' to get all_events.json.")
-    with open(events_path, 'r', encoding='utf-8') as f:
-        events = json.load(f)
+def _collect_trades(events):
     trades = []
     for ev in events:
         if not isinstance(ev, dict):
@@ -166,6 +210,34 @@ def load_trades(events_path: Path):
         t = parse_trade_event(ev)
         if t:
             trades.append(t)
+    return trades
+
+
+def load_trades(events_path: Path, stream=False):
+    """Read and parse all executed trades, sorted by timestamp.
+
+    Trades are sorted on the raw ISO timestamp string. That is chronological
+    because TR exports all timestamps in UTC (`+0000`).
+
+    With `stream` the export is parsed incrementally via ijson so only one
+    event is held in memory at a time (for very large timelines).
+    """
+    if not events_path.exists():
+        raise SystemExit(f"{events_path} not found. Run 'pytr dl_docs <outdir>' to get all_events.json.")
+    if stream:
+        try:
+            import ijson
+        except ImportError:
+            raise SystemExit("--stream requires ijson (pip install ijson).")
+        with open(events_path, 'rb') as f:
+            trades = _collect_trades(ijson.items(f, 'item', use_float=True))
+    else:
+        if orjson is not None:
+            events = orjson.loads(events_path.read_bytes())
+        else:
+            with open(events_path, 'r', encoding='utf-8') as f:
+                events = json.load(f)
+        trades = _collect_trades(events)
     trades.sort(key=lambda x: x['timestamp'])
     return trades
 
@@ -176,62 +248,70 @@ def avg_realized(trades, year=2025):
     - One pool (27.5 % KESt) across instruments.
     - Fees/spesen are ignored (not deductible for private capital assets).
     - Inventory is updated for all years; only sales in `year` are reported.
+    - Trades after `year` are skipped; they cannot affect its result.
     """
 
-    positions = defaultdict(lambda: {'qty': 0.0, 'cost': 0.0})
+    # per-ISIN inventory as parallel lists addressed by a dense integer index
+    isin_idx = {}
+    qty = []
+    cost = []
     realized_total = 0.0
     per_sale = []
     warnings = []
     nonstock_warned = set()
 
     for tr in trades:
-        if tr['shares'] is None or tr['total'] is None:
+        tr_year = tr['year']
+        if tr_year is not None and tr_year > year:
+            continue  # later trades cannot affect this year's result
+        shares = tr['shares']
+        total = tr['total']
+        if shares is None or total is None:
             continue
+        isin = tr['isin']
 
-        if tr.get('instrument_type') != 'stock' and tr['isin'] not in nonstock_warned:
+        if tr.get('instrument_type') != 'stock' and isin not in nonstock_warned:
             warnings.append(
-                f"Instrumententyp '{tr.get('instrument_type')}' für {tr['title']} ({tr['isin']}): kein separater Topf implementiert – alles im 27,5%-Pool."
+                f"Instrumententyp '{tr.get('instrument_type')}' für {tr['title']} ({isin}): kein separater Topf implementiert – alles im 27,5%-Pool."
             )
-            nonstock_warned.add(tr['isin'])
+            nonstock_warned.add(isin)
+
+        i = isin_idx.get(isin)
+        if i is None:
+            i = isin_idx[isin] = len(qty)
+            qty.append(0.0)
+            cost.append(0.0)
 
         fee = tr.get('fee') or 0.0
         if tr['side'] == 'buy':
             # total is net (negative). For Austrian law exclude fees.
-            cost_add = max(0.0, abs(tr['total']) - fee)
-            pos = positions[tr['isin']]
-            pos['qty'] += tr['shares']
-            pos['cost'] += cost_add
+            qty[i] += shares
+            cost[i] += max(0.0, abs(total) - fee)
         else:  # sell
-            proceeds = tr['total'] + fee  # add fee back to get gross proceeds
+            proceeds = total + fee  # add fee back to get gross proceeds
 
-            pos = positions[tr['isin']]
-            available = pos['qty']
-            avg_cost = (pos['cost'] / pos['qty']) if pos['qty'] > 1e-9 else 0.0
-            used_qty = min(tr['shares'], available)
+            available = qty[i]
+            avg_cost = (cost[i] / available) if available > 1e-9 else 0.0
+            used_qty = min(shares, available)
             cost_basis = used_qty * avg_cost
-            pos['qty'] -= used_qty
-            pos['cost'] -= used_qty * avg_cost
-            if pos['qty'] < 1e-9:
-                pos['qty'] = 0.0
-                pos['cost'] = 0.0
-
-            if tr['shares'] - used_qty > 1e-6:
+            remaining = available - used_qty
+            if remaining < 1e-9:
+                qty[i] = 0.0
+                cost[i] = 0.0
+            else:
+                qty[i] = remaining
+                cost[i] -= cost_basis
+
+            missing = shares - used_qty
+            if missing > 1e-6:
                 warnings.append(
-                    f"Kein/zu wenig Bestand für {tr['title']} ({tr['isin']}) – {tr['shares'] - used_qty:.4f} Stück ohne Anschaffungskosten angesetzt."
+                    f"Kein/zu wenig Bestand für {tr['title']} ({isin}) – {missing:.4f} Stück ohne Anschaffungskosten angesetzt."
                 )
 
-            if tr['timestamp'].year == year:
+            if tr_year == year:
                 profit = proceeds - cost_basis
                 realized_total += profit
-                per_sale.append({
-                    'date': tr['timestamp'].date(),
-                    'isin': tr['isin'],
-                    'title': tr['title'],
-                    'shares': tr['shares'],
-                    'proceeds': proceeds,
-                    'cost_basis': cost_basis,
-                    'profit': profit,
-                })
+                per_sale.append(Sale(date.fromisoformat(tr['timestamp'][:10]), tr['title'], isin, shares, proceeds, cost_basis, profit))
 
     return realized_total, per_sale, warnings
 
@@ -240,16 +320,17 @@ def main():
     parser = argparse.ArgumentParser(description="Compute Austrian KESt gains (gleitender Durchschnitt) from Trade Republic timeline JSON")
     parser.add_argument('--events', default='all_events.json', type=Path, help="Path to all_events.json from pytr dl_docs")
     parser.add_argument('--year', type=int, default=datetime.now().year, help="Tax year to evaluate (default: current year)")
+    parser.add_argument('--stream', action='store_true', help="Parse the events file incrementally (needs ijson; for very large exports)")
     args = parser.parse_args()
 
-    trades = load_trades(args.events)
+    trades = load_trades(args.events, stream=args.stream)
     realized, per_sale, warnings = avg_realized(trades, year=args.year)
 
     print(f'Realisierte Gewinne/Verluste {args.year}')
     print(f"  Gesamt (27,5 % KESt): {realized:.2f} EUR")
     print('\nDetails pro Verkauf:')
     for s in per_sale:
-        print(f"  {s['date']} {s['title']} ({s['isin']}) | {s['shares']} Stk | Erlös {s['proceeds']:.2f} | Kosten {s['cost_basis']:.2f} | PnL {s['profit']:.2f}")
+        print(f"  {s.date} {s.title} ({s.isin}) | {s.shares} Stk | Erlös {s.proceeds:.2f} | Kosten {s.cost_basis:.2f} | PnL {s.profit:.2f}")
 
     # Write CSV for further analysis
     import csv
@@ -257,8 +338,10 @@ def main():
     with out_path.open('w', newline='', encoding='utf-8') as f:
         w = csv.writer(f, delimiter=';')
         w.writerow(['date', 'title', 'isin', 'shares', 'proceeds_eur', 'cost_basis_eur', 'profit_eur'])
-        for s in per_sale:
-            w.writerow([s['date'], s['title'], s['isin'], s['shares'], f"{s['proceeds']:.2f}", f"{s['cost_basis']:.2f}", f"{s['profit']:.2f}"])
+        w.writerows(
+            (s.date, s.title, s.isin, s.shares, f"{s.proceeds:.2f}", f"{s.cost_basis:.2f}", f"{s.profit:.2f}")
+            for s in per_sale
+        )
     print(f"\nCSV gespeichert: {out_path}")
     if warnings:
         print("\nWARNUNGEN:")
@@ -0,0 +1,108 @@
+import functools
+import json
+import sys
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import compute_avg_cost as cv
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+_COMMA_TBL = str.maketrans('.', ',')
+_SIGN = {"buy": -1.0, "sell": 1.0}
+_SUBTITLE = {"buy": "Kauforder", "sell": "Verkaufsorder"}
+_ACTION_TMPL = {"type": "timelineDetail", "payload": "dummy"}  # shared by all events; the parser never mutates it
+
+
+def fmt(val):
+    """German number format (comma as decimal separator), two decimals."""
+    return format(val, '.2f').translate(_COMMA_TBL)
+
+
+def make_event(side: str, *, isin: str, shares: float, price: float, fee: float = 0.0, dt: str = "2025-01-01T10:00:00.000+0000", instrument_type: Optional[str] = None):
+    """Build a minimal TR-like event with net cash totals.
+
+    Buys: -(price*shares + fee); Sells: price*shares - fee (fees reduce proceeds).
+    """
+
+    subtitle = _SUBTITLE[side]
+    gross = price * shares
+    total = _SIGN[side] * gross - fee
+
+    # Build a minimal event matching TR structure that our parser expects
+    # Use German number format (comma as decimal separator)
+    str_shares = str(shares).translate(_COMMA_TBL)
+    fmt_price = fmt(price)
+    fmt_gross = fmt(gross)
+    fmt_fee = fmt(fee)
+    fmt_total = fmt(total)
+
+    transaction_rows = [
+        {"title": "Aktien", "detail": {"text": str_shares, "displayValue": {"text": str_shares}}},
+        {"title": "Aktienkurs", "detail": {"text": fmt_price, "displayValue": {"text": fmt_price}}},
+        {"title": "Summe", "detail": {"text": fmt_gross, "displayValue": {"text": fmt_gross}}},
+    ]
+    inner_payload = {"sections": [{"type": "table", "data": transaction_rows}]}
+
+    overview = [
+        {"title": "Transaktion", "detail": {"action": {"payload": inner_payload}, "text": f"{str_shares} × {fmt_price}"}},
+        {"title": "Gebühr", "detail": {"text": fmt_fee, "displayValue": {"text": fmt_fee}}},
+        {"title": "Summe", "detail": {"text": fmt_total, "displayValue": {"text": fmt_total}}},
+    ]
+
+    if instrument_type:
+        overview[0]["instrumentType"] = instrument_type
+
+    event = {
+        "id": "dummy",
+        "timestamp": dt,
+        "title": "TEST",
+        "subtitle": subtitle,
+        "status": "EXECUTED",
+        "amount": {"currency": "EUR", "value": total, "fractionDigits": 2},
+        "action": _ACTION_TMPL,
+        "details": {
+            "sections": [
+                {"type": "header", "title": "header", "action": {"payload": isin}},
+                {"type": "table", "title": "Übersicht", "data": overview},
+            ]
+        },
+    }
+    return event
+
+
+@functools.lru_cache(maxsize=None)
+def parsed_trade(side: str, *, isin: str, shares: float, price: float, fee: float = 0.0, dt: str = "2025-01-01T10:00:00.000+0000", instrument_type: Optional[str] = None):
+    """Parse `make_event(...)` once per distinct argument set for the whole session.
+
+    Repeated calls return the same dict, so tests must treat it as read-only.
+    """
+    return cv.parse_trade_event(make_event(side, isin=isin, shares=shares, price=price, fee=fee, dt=dt, instrument_type=instrument_type))
+
+
+@pytest.fixture(scope="session", name="make_event")
+def make_event_fixture():
+    return make_event
+
+
+@pytest.fixture(scope="session")
+def trade():
+    return parsed_trade
+
+
+@pytest.fixture(scope="session")
+def sample_events():
+    """Stored TR-like export (newest first, incl. a cancelled order and an interest payment)."""
+    raw = (FIXTURES / "trades_2025.json").read_bytes()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
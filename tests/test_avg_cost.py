@@ -1,215 +1,205 @@
-import sys
-from pathlib import Path
-from datetime import datetime
-from typing import Optional
+import json
+from datetime import date
+from math import isclose
 
-ROOT = Path(__file__).resolve().parents[1]
-if str(ROOT) not in sys.path:
-    sys.path.insert(0, str(ROOT))
+import pytest
 
 import compute_avg_cost as cv
 
 
-def make_event(side: str, *, isin: str, shares: float, price: float, fee: float = 0.0, dt: str = "2025-01-01T10:00:00.000+0000", instrument_type: Optional[str] = None):
-    """Build a minimal TR-like event with net cash totals.
-
-    Buys: -(price*shares + fee); Sells: price*shares - fee (fees reduce proceeds).
-    """
-
-    subtitle = "Kauforder" if side == "buy" else "Verkaufsorder"
-    if side == "buy":
-        total = -(price * shares + fee)
-    else:
-        total = price * shares - fee
-
-    # Build a minimal event matching TR structure that our parser expects
-    # Use German number format (comma as decimal separator)
-    def fmt(val):
-        return f"{val:.2f}".replace('.', ',')
-
-    transaction_rows = [
-        {"title": "Aktien", "detail": {"text": str(shares), "displayValue": {"text": str(shares)}}},
-        {"title": "Aktienkurs", "detail": {"text": fmt(price), "displayValue": {"text": fmt(price)}}},
-        {"title": "Summe", "detail": {"text": fmt(price*shares), "displayValue": {"text": fmt(price*shares)}}},
-    ]
-    inner_payload = {"sections": [{"type": "table", "data": transaction_rows}]}
-
-    overview = [
-        {"title": "Transaktion", "detail": {"action": {"payload": inner_payload}, "text": f"{shares} × {fmt(price)}"}},
-        {"title": "Gebühr", "detail": {"text": fmt(fee), "displayValue": {"text": fmt(fee)}}},
-        {"title": "Summe", "detail": {"text": fmt(total), "displayValue": {"text": fmt(total)}}},
-    ]
-
-    if instrument_type:
-        overview[0]["instrumentType"] = instrument_type
-
-    event = {
-        "id": "dummy",
-        "timestamp": dt,
-        "title": "TEST",
-        "subtitle": subtitle,
-        "status": "EXECUTED",
-        "amount": {"currency": "EUR", "value": total, "fractionDigits": 2},
-        "action": {"type": "timelineDetail", "payload": "dummy"},
-        "details": {
-            "sections": [
-                {"type": "header", "title": "header", "action": {"payload": isin}},
-                {"type": "table", "title": "Übersicht", "data": overview},
-            ]
-        },
-    }
-    return event
-
-
-def parse(ev):
-    return cv.parse_trade_event(ev)
-
-
-def test_parse_basic_buy_sell():
-    buy = parse(make_event("buy", isin="US0000000001", shares=10, price=100, fee=1))
-    sell = parse(make_event("sell", isin="US0000000001", shares=4, price=150, fee=1, dt="2025-02-01T10:00:00.000+0000"))
+def test_parse_basic_buy_sell(trade):
+    buy = trade("buy", isin="US0000000001", shares=10, price=100, fee=1)
+    sell = trade("sell", isin="US0000000001", shares=4, price=150, fee=1, dt="2025-02-01T10:00:00.000+0000")
     assert buy["side"] == "buy"
     assert sell["side"] == "sell"
-    assert abs(buy["total"] + 1001.0) < 1e-6  # buy totals stored negative
-    assert abs(sell["total"] - 599.0) < 1e-6  # sell net after fee
-
-
-def test_avg_cost_profit():
+    assert isclose(buy["total"], -1001.0, abs_tol=1e-6)  # buy totals stored negative
+    assert isclose(sell["total"], 599.0, abs_tol=1e-6)  # sell net after fee
+
+
+def test_parse_keeps_raw_timestamp_and_year(trade):
+    buy = trade("buy", isin="US0000000014", shares=1, price=10, dt="2024-12-31T23:00:00.000+0000")
+    sell = trade("sell", isin="US0000000014", shares=1, price=12, dt="2025-01-02T09:30:00.000+0000")
+    assert buy["timestamp"] == "2024-12-31T23:00:00.000+0000"
+    assert buy["year"] == 2024
+    _, per_sale, _ = cv.avg_realized([buy, sell], year=2025)
+    assert per_sale[0].date == date(2025, 1, 2)
+
+
+def test_parse_skips_event_without_timestamp(make_event):
+    ev = make_event("buy", isin="US0000000017", shares=1, price=10)
+    del ev["timestamp"]
+    assert cv.parse_trade_event(ev) is None
+
+
+def test_parse_shares_german_format():
+    assert cv.parse_shares("1.234,56") == 1234.56
+    assert cv.parse_shares("0,5") == 0.5
+    assert cv.parse_shares("10,5") == 10.5
+    assert cv.parse_shares("1.500") == 1500.0
+    assert cv.parse_money("1.234,56 €") == 1234.56
+
+
+# (trades as (side, isin, shares, price, fee, dt), expected realized, expected sales as (cost_basis, profit))
+SCENARIOS = [
+    pytest.param(
+        [("buy", "US0000000001", 10, 100, 0, "2025-01-01T10:00:00.000+0000"),
+         ("sell", "US0000000001", 4, 150, 0, "2025-03-01T00:00:00.000+0000")],
+        200.0, [(400.0, 200.0)],
+        id="avg_cost_profit",  # average cost stays 100 → cost basis 4*100=400
+    ),
+    pytest.param(
+        [("buy", "US0000000004", 10, 100, 0, "2025-01-01T00:00:00.000+0000"),
+         ("buy", "US0000000004", 5, 120, 0, "2025-02-01T00:00:00.000+0000"),
+         ("sell", "US0000000004", 12, 150, 0, "2025-03-01T00:00:00.000+0000")],
+        520.0, [(1280.0, 520.0)],
+        id="multiple_buys",  # avg cost (10*100 + 5*120) / 15 = 106.67, cost basis 12*avg = 1280
+    ),
+    pytest.param(
+        [("buy", "US0000000005", 10, 100, 0, "2025-01-01T10:00:00.000+0000"),
+         ("sell", "US0000000005", 10, 80, 0, "2025-03-01T00:00:00.000+0000")],
+        -200.0, [(1000.0, -200.0)],
+        id="realized_loss_negative",  # losses stay negative
+    ),
+    pytest.param(
+        [("buy", "US0000000006", 10, 100, 0, "2024-01-01T00:00:00.000+0000"),
+         ("sell", "US0000000006", 5, 160, 0, "2024-12-01T00:00:00.000+0000"),
+         ("sell", "US0000000006", 3, 150, 0, "2025-03-01T00:00:00.000+0000")],
+        150.0, [(300.0, 150.0)],
+        id="year_filtering",  # 2024 sale consumes inventory but is not reported
+    ),
+    pytest.param(
+        [("buy", "US0000000007", 10, 100, 0, "2025-01-01T00:00:00.000+0000"),
+         ("sell", "US0000000007", 3, 150, 0, "2025-02-01T00:00:00.000+0000"),
+         ("sell", "US0000000007", 5, 140, 0, "2025-03-01T00:00:00.000+0000")],
+        350.0, [(300.0, 150.0), (500.0, 200.0)],
+        id="partial_consumption",  # average cost unchanged until new buys
+    ),
+    pytest.param(
+        [("buy", "US0000000008", 10, 100, 5, "2025-01-01T00:00:00.000+0000"),
+         ("sell", "US0000000008", 10, 150, 3, "2025-02-01T00:00:00.000+0000")],
+        500.0, [(1000.0, 500.0)],
+        id="fees_ignored",  # fees excluded from cost and proceeds (AT private capital assets)
+    ),
+    pytest.param(
+        [("buy", "US0000000009", 10, 100, 0, "2025-01-01T00:00:00.000+0000"),
+         ("buy", "US0000000010", 10, 50, 0, "2025-01-02T00:00:00.000+0000"),
+         ("sell", "US0000000009", 5, 150, 0, "2025-02-01T00:00:00.000+0000"),
+         ("sell", "US0000000010", 5, 80, 0, "2025-02-02T00:00:00.000+0000")],
+        400.0, [(500.0, 250.0), (250.0, 150.0)],
+        id="multiple_isins",  # tracked per ISIN, aggregated into one pot
+    ),
+    pytest.param(
+        [("buy", "US0000000011", 10.5, 100, 0, "2025-01-01T00:00:00.000+0000"),
+         ("sell", "US0000000011", 3.7, 150, 0, "2025-02-01T00:00:00.000+0000")],
+        185.0, [(370.0, 185.0)],
+        id="fractional_shares",  # common with TR savings plans
+    ),
+]
+
+
+@pytest.mark.parametrize("spec, expected_realized, expected_sales", SCENARIOS)
+def test_avg_realized_scenario(trade, spec, expected_realized, expected_sales):
     trades = [
-        parse(make_event("buy", isin="US0000000001", shares=10, price=100, fee=0)),
-        parse(make_event("sell", isin="US0000000001", shares=4, price=150, fee=0, dt="2025-03-01T00:00:00.000+0000")),
+        trade(side, isin=isin, shares=shares, price=price, fee=fee, dt=dt)
+        for side, isin, shares, price, fee, dt in spec
     ]
     realized, per_sale, warnings = cv.avg_realized(trades, year=2025)
     assert not warnings
-    # average cost stays 100 → cost basis 4*100=400, profit 200
-    assert abs(realized - 200.0) < 1e-6
-    assert len(per_sale) == 1
-
-
-def test_single_pot_and_derivatives():
-    stock_sell = parse(make_event("sell", isin="US0000000002", shares=1, price=50, fee=0, dt="2025-04-01T00:00:00.000+0000"))
-    stock_buy = parse(make_event("buy", isin="US0000000002", shares=1, price=30, fee=0, dt="2025-03-01T00:00:00.000+0000"))
-    deriv_buy = parse(make_event("buy", isin="DE000DERIV01", shares=2, price=10, fee=0, dt="2025-03-02T00:00:00.000+0000", instrument_type="derivative"))
-    deriv_sell = parse(make_event("sell", isin="DE000DERIV01", shares=2, price=15, fee=0, dt="2025-04-02T00:00:00.000+0000", instrument_type="derivative"))
+    assert isclose(realized, expected_realized, abs_tol=1e-6)
+    assert len(per_sale) == len(expected_sales)
+    for sale, (cost_basis, profit) in zip(per_sale, expected_sales):
+        assert isclose(sale.cost_basis, cost_basis, abs_tol=1e-6)
+        assert isclose(sale.profit, profit, abs_tol=1e-6)
+
+
+def test_single_pot_and_derivatives(trade):
+    stock_sell = trade("sell", isin="US0000000002", shares=1, price=50, fee=0, dt="2025-04-01T00:00:00.000+0000")
+    stock_buy = trade("buy", isin="US0000000002", shares=1, price=30, fee=0, dt="2025-03-01T00:00:00.000+0000")
+    deriv_buy = trade("buy", isin="DE000DERIV01", shares=2, price=10, fee=0, dt="2025-03-02T00:00:00.000+0000", instrument_type="derivative")
+    deriv_sell = trade("sell", isin="DE000DERIV01", shares=2, price=15, fee=0, dt="2025-04-02T00:00:00.000+0000", instrument_type="derivative")
     trades = [stock_buy, stock_sell, deriv_buy, deriv_sell]
     realized, per_sale, warnings = cv.avg_realized(trades, year=2025)
     assert warnings  # warn that derivatives share the same pool
     # single pot: profit 20 + 10 = 30 regardless of instrument_type
-    assert abs(realized - 30.0) < 1e-6
+    assert isclose(realized, 30.0, abs_tol=1e-6)
 
 
-def test_warning_on_inventory_shortage():
-    buy = parse(make_event("buy", isin="US0000000003", shares=1, price=10, fee=0))
-    sell = parse(make_event("sell", isin="US0000000003", shares=2, price=12, fee=0, dt="2025-05-01T00:00:00.000+0000"))
+def test_warning_on_inventory_shortage(trade):
+    buy = trade("buy", isin="US0000000003", shares=1, price=10, fee=0)
+    sell = trade("sell", isin="US0000000003", shares=2, price=12, fee=0, dt="2025-05-01T00:00:00.000+0000")
     realized, per_sale, warnings = cv.avg_realized([buy, sell], year=2025)
     assert warnings  # should warn about missing inventory
     assert len(per_sale) == 1
 
 
-def test_avg_cost_multiple_buys():
-    """Average cost method pools lots; cost basis uses weighted average."""
+def test_trades_after_year_ignored(trade):
+    """Trades after the reporting year neither count nor warn."""
     trades = [
-        parse(make_event("buy", isin="US0000000004", shares=10, price=100, fee=0, dt="2025-01-01T00:00:00.000+0000")),
-        parse(make_event("buy", isin="US0000000004", shares=5, price=120, fee=0, dt="2025-02-01T00:00:00.000+0000")),
-        parse(make_event("sell", isin="US0000000004", shares=12, price=150, fee=0, dt="2025-03-01T00:00:00.000+0000")),
+        trade("buy", isin="US0000000015", shares=2, price=100, fee=0, dt="2025-01-01T00:00:00.000+0000"),
+        trade("sell", isin="US0000000015", shares=5, price=120, fee=0, dt="2026-01-01T00:00:00.000+0000"),
     ]
     realized, per_sale, warnings = cv.avg_realized(trades, year=2025)
+    assert realized == 0.0
+    assert not per_sale
     assert not warnings
-    # avg cost = (10*100 + 5*120) / 15 = 106.666..., cost basis 12*avg = 1280
-    # Proceeds: 12*150 = 1800, profit 520
-    assert abs(realized - 520.0) < 1e-6
-    assert len(per_sale) == 1
-    assert abs(per_sale[0]["cost_basis"] - 1280.0) < 1e-6
 
 
-def test_realized_loss_negative():
-    """Losses stay negative with average cost."""
+def test_trades_after_year_skipped_in_unsorted_input(trade):
+    """A later-year trade before a reporting-year sale must not hide that sale."""
     trades = [
-        parse(make_event("buy", isin="US0000000005", shares=10, price=100, fee=0)),
-        parse(make_event("sell", isin="US0000000005", shares=10, price=80, fee=0, dt="2025-03-01T00:00:00.000+0000")),
+        trade("buy", isin="US0000000018", shares=1, price=10, fee=0, dt="2025-01-01T00:00:00.000+0000"),
+        trade("buy", isin="US0000000019", shares=1, price=10, fee=0, dt="2026-01-01T00:00:00.000+0000"),
+        trade("sell", isin="US0000000018", shares=1, price=15, fee=0, dt="2025-06-01T00:00:00.000+0000"),
     ]
     realized, per_sale, warnings = cv.avg_realized(trades, year=2025)
     assert not warnings
-    # cost basis 10*100=1000, proceeds 10*80=800 → loss -200
-    assert abs(realized - (-200.0)) < 1e-6
+    assert isclose(realized, 5.0, abs_tol=1e-6)
     assert len(per_sale) == 1
-    assert per_sale[0]["profit"] < 0
 
 
-def test_year_filtering():
-    """Test that only sales in the target year are counted."""
-    trades = [
-        parse(make_event("buy", isin="US0000000006", shares=10, price=100, fee=0, dt="2024-01-01T00:00:00.000+0000")),
-        parse(make_event("sell", isin="US0000000006", shares=5, price=160, fee=0, dt="2024-12-01T00:00:00.000+0000")),
-        parse(make_event("sell", isin="US0000000006", shares=3, price=150, fee=0, dt="2025-03-01T00:00:00.000+0000")),
-    ]
-    # Calculate for 2025 only
-    realized, per_sale, warnings = cv.avg_realized(trades, year=2025)
+def test_trade_without_year_is_not_compared(trade):
+    buy = dict(trade("buy", isin="US0000000020", shares=1, price=10, fee=0), year=None)
+    sell = trade("sell", isin="US0000000020", shares=1, price=15, fee=0, dt="2025-06-01T00:00:00.000+0000")
+    realized, per_sale, warnings = cv.avg_realized([buy, sell], year=2025)
     assert not warnings
-    # 2024 sale consumed 5 shares from inventory (not counted in 2025 profit)
-    # 2025 sale: 3 @ 150 = 450, cost basis 3 @ 100 = 300 → profit 150
-    assert abs(realized - 150.0) < 1e-6
-    assert len(per_sale) == 1  # only 2025 sale
+    assert isclose(realized, 5.0, abs_tol=1e-6)
 
 
-def test_partial_consumption_avg_cost():
-    """Average cost remains unchanged until new buys; partial sells reduce quantity and cost proportionally."""
-    trades = [
-        parse(make_event("buy", isin="US0000000007", shares=10, price=100, fee=0, dt="2025-01-01T00:00:00.000+0000")),
-        parse(make_event("sell", isin="US0000000007", shares=3, price=150, fee=0, dt="2025-02-01T00:00:00.000+0000")),
-        parse(make_event("sell", isin="US0000000007", shares=5, price=140, fee=0, dt="2025-03-01T00:00:00.000+0000")),
+@pytest.mark.parametrize("use_orjson", [True, False], ids=["orjson", "json"])
+def test_load_trades_sorted(tmp_path, make_event, monkeypatch, use_orjson):
+    """Events file is read from disk; non-trades are dropped and trades sorted by time."""
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(cv, "orjson", None)
+    events = [
+        make_event("sell", isin="US0000000012", shares=1, price=20, fee=0, dt="2025-02-01T00:00:00.000+0000"),
+        {"title": "Zinsen", "subtitle": "Zinszahlung"},
+        make_event("buy", isin="US0000000012", shares=1, price=10, fee=0, dt="2025-01-01T00:00:00.000+0000"),
     ]
-    realized, per_sale, warnings = cv.avg_realized(trades, year=2025)
-    assert not warnings
-    # First sale: 3 @ 150 - 3 @ 100 = 150 profit
-    # Second sale: 5 @ 140 - 5 @ 100 = 200 profit
-    assert abs(realized - 350.0) < 1e-6
-    assert len(per_sale) == 2
-    assert abs(per_sale[0]["profit"] - 150.0) < 1e-6
-    assert abs(per_sale[1]["profit"] - 200.0) < 1e-6
+    path = tmp_path / "all_events.json"
+    path.write_text(json.dumps(events), encoding="utf-8")
+    trades = cv.load_trades(path)
+    assert [t["side"] for t in trades] == ["buy", "sell"]
 
 
-def test_fees_in_cost_basis():
-    """Fees are ignored for cost/proceeds (Austrian private capital assets)."""
-    trades = [
-        parse(make_event("buy", isin="US0000000008", shares=10, price=100, fee=5, dt="2025-01-01T00:00:00.000+0000")),
-        parse(make_event("sell", isin="US0000000008", shares=10, price=150, fee=3, dt="2025-02-01T00:00:00.000+0000")),
-    ]
+def test_sample_export(sample_events):
+    trades = [t for t in map(cv.parse_trade_event, sample_events) if t]
+    assert [t["side"] for t in trades] == ["sell", "buy"]  # cancelled order and interest skipped
+    trades.sort(key=lambda t: t["timestamp"])
     realized, per_sale, warnings = cv.avg_realized(trades, year=2025)
     assert not warnings
-    # Buy cost excludes fee: 10*100 = 1000
-    # Sell proceeds exclude fee: 10*150 = 1500
-    # Profit: 500
-    assert abs(realized - 500.0) < 1e-6
+    # 4 of 10 @ avg 100 sold @ 150, fees ignored → profit 200
+    assert isclose(realized, 200.0, abs_tol=1e-6)
     assert len(per_sale) == 1
 
 
-def test_multiple_isins_separate_pools():
-    """Average cost tracking stays per ISIN but results aggregate into one pot."""
-    trades = [
-        parse(make_event("buy", isin="US0000000009", shares=10, price=100, fee=0, dt="2025-01-01T00:00:00.000+0000")),
-        parse(make_event("buy", isin="US0000000010", shares=10, price=50, fee=0, dt="2025-01-02T00:00:00.000+0000")),
-        parse(make_event("sell", isin="US0000000009", shares=5, price=150, fee=0, dt="2025-02-01T00:00:00.000+0000")),
-        parse(make_event("sell", isin="US0000000010", shares=5, price=80, fee=0, dt="2025-02-02T00:00:00.000+0000")),
+def test_load_trades_stream_matches_full_load(tmp_path, make_event):
+    pytest.importorskip("ijson")
+    events = [
+        make_event("buy", isin="US0000000013", shares=2, price=10, fee=1, dt="2025-01-01T00:00:00.000+0000"),
+        make_event("sell", isin="US0000000013", shares=2, price=12, fee=1, dt="2025-02-01T00:00:00.000+0000"),
     ]
-    realized, per_sale, warnings = cv.avg_realized(trades, year=2025)
-    assert not warnings
-    # ISIN 009 profit 250, ISIN 010 profit 150, total 400
-    assert abs(realized - 400.0) < 1e-6
-    assert len(per_sale) == 2
-
-
-def test_fractional_shares():
-    """Test that fractional shares are handled correctly (common with TR savings plans)."""
-    trades = [
-        parse(make_event("buy", isin="US0000000011", shares=10.5, price=100, fee=0, dt="2025-01-01T00:00:00.000+0000")),
-        parse(make_event("sell", isin="US0000000011", shares=3.7, price=150, fee=0, dt="2025-02-01T00:00:00.000+0000")),
-    ]
-    realized, per_sale, warnings = cv.avg_realized(trades, year=2025)
-    assert not warnings
-    # Cost basis: 3.7 * 100 = 370
-    # Proceeds: 3.7 * 150 = 555
-    # Profit: 555 - 370 = 185
-    assert abs(realized - 185.0) < 1e-6
-    assert len(per_sale) == 1
-    assert abs(per_sale[0]["cost_basis"] - 370.0) < 1e-6
+    path = tmp_path / "all_events.json"
+    path.write_text(json.dumps(events), encoding="utf-8")
+    assert cv.load_trades(path, stream=True) == cv.load_trades(path)